@@ -2,8 +2,13 @@ import streamlit as st
 import torch
 from PIL import Image, ImageDraw, ImageFont
 import numpy as np
+import torchvision
 import cv2
 import os
+import queue
+import subprocess
+import sys
+import threading
 
 # Configure page
 st.set_page_config(
@@ -12,6 +17,311 @@ st.set_page_config(
     layout="wide"
 )
 
+# Input shape is fixed, so let cuDNN pick the fastest conv kernels once
+torch.backends.cudnn.benchmark = True
+
+# The app never trains, so skip autograd bookkeeping everywhere
+torch.set_grad_enabled(False)
+
+IMG_SIZE = 640
+OPENVINO_MODEL_DIR = 'pcb_defect_openvino_model'
+OPENVINO_MODEL_XML = os.path.join(OPENVINO_MODEL_DIR, 'pcb_defect.xml')
+ONNX_MODEL = 'pcb_defect.onnx'
+
+# The model keeps every candidate down to the lowest slider value and skips NMS
+# (IoU 1.0); thresholds are applied afterwards by filter_detections
+CANDIDATE_CONF = 0.1
+CANDIDATE_IOU = 1.0
+
+# YOLOv5's limits: boxes fed into NMS, and detections kept after it. Without
+# NMS the candidate pass may only apply the pre-NMS cap
+MAX_NMS = 30000
+MAX_DET = 1000
+
+# Drawing lookup tables, shared by every request
+CLASS_NAMES = ('missing_hole', 'mouse_bite', 'open_circuit', 'short', 'spur', 'spurious_copper')
+COLORS = np.array([(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 0), (255, 0, 255), (0, 255, 255)], dtype=np.uint8)
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+def letterbox(img, new_shape=IMG_SIZE, color=(114, 114, 114)):
+    """Resize and pad an RGB array to a square model input, keeping aspect ratio"""
+    h, w = img.shape[:2]
+    r = min(new_shape / h, new_shape / w)
+    new_w, new_h = int(round(w * r)), int(round(h * r))
+    
+    if (new_w, new_h) != (w, h):
+        img = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    
+    # Split the padding evenly between both sides
+    dw, dh = (new_shape - new_w) / 2, (new_shape - new_h) / 2
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    img = cv2.copyMakeBorder(img, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)
+    return img, r, (left, top)
+
+@torch.inference_mode()
+def postprocess(pred, conf_thres, iou_thres, ratio, pad, orig_shape, max_det=MAX_DET, max_nms=MAX_NMS):
+    """Decode raw YOLOv5 output into an (N, 6) tensor of xyxy, confidence, class"""
+    pred = torch.as_tensor(pred)[0].float()
+    pred = pred[pred[:, 4] >= conf_thres]
+    
+    # Final confidence is objectness times the best class probability
+    conf, cls = (pred[:, 5:] * pred[:, 4:5]).max(1)
+    keep = conf >= conf_thres
+    xywh, conf, cls = pred[keep, :4], conf[keep], cls[keep]
+    
+    # Only the most confident boxes go into NMS
+    if conf.shape[0] > max_nms:
+        keep = conf.topk(max_nms).indices
+        xywh, conf, cls = xywh[keep], conf[keep], cls[keep]
+    
+    boxes = torch.cat([xywh[:, :2] - xywh[:, 2:] / 2, xywh[:, :2] + xywh[:, 2:] / 2], 1)
+    keep = torchvision.ops.batched_nms(boxes, conf, cls, iou_thres)[:max_det]
+    boxes, conf, cls = boxes[keep], conf[keep], cls[keep]
+    
+    # Undo the letterbox so boxes line up with the original image
+    h, w = orig_shape
+    boxes[:, [0, 2]] = ((boxes[:, [0, 2]] - pad[0]) / ratio).clamp(0, w)
+    boxes[:, [1, 3]] = ((boxes[:, [1, 3]] - pad[1]) / ratio).clamp(0, h)
+    return torch.cat([boxes, conf[:, None], cls[:, None].float()], 1)
+
+class Detections:
+    """Minimal stand-in for YOLOv5's Detections with the same xyxy layout"""
+    
+    def __init__(self, det):
+        self.xyxy = [det]
+
+class OpenVINOModel:
+    """YOLOv5 OpenVINO IR wrapped to be called like the torch.hub model"""
+    
+    def __init__(self, xml_path):
+        from openvino.runtime import Core
+        
+        core = Core()
+        self.compiled = core.compile_model(xml_path, 'CPU', {
+            'PERFORMANCE_HINT': 'LATENCY',
+            'INFERENCE_NUM_THREADS': os.cpu_count()
+        })
+        self.output = self.compiled.output(0)
+        self.conf = CANDIDATE_CONF
+        self.iou = CANDIDATE_IOU
+        self.max_det = MAX_NMS
+    
+    def __call__(self, image):
+        img = np.asarray(image)
+        tensor, ratio, pad = letterbox(img)
+        
+        # HWC uint8 -> NCHW float32 in [0, 1]
+        tensor = tensor.transpose(2, 0, 1)[None].astype(np.float32) / 255.0
+        pred = self.compiled([tensor])[self.output]
+        return Detections(postprocess(pred, self.conf, self.iou, ratio, pad, img.shape[:2], self.max_det))
+
+class TorchModel:
+    """Raw YOLOv5 network with the app's letterbox and postprocess around it"""
+    
+    def __init__(self, net, device):
+        self.net = net
+        self.device = device
+        self.dtype = torch.half if net.fp16 else torch.float
+        self.conf = CANDIDATE_CONF
+        self.iou = CANDIDATE_IOU
+        self.max_det = MAX_NMS
+    
+    @torch.inference_mode()
+    def __call__(self, image):
+        img = np.asarray(image)
+        tensor, ratio, pad = letterbox(img)
+        
+        x = torch.from_numpy(tensor).to(self.device).permute(2, 0, 1)[None]
+        out = self.net(x.to(self.dtype).div_(255.0))
+        pred = out[0] if isinstance(out, (list, tuple)) else out
+        return Detections(postprocess(pred, self.conf, self.iou, ratio, pad, img.shape[:2], self.max_det))
+
+class CUDAGraphModel:
+    """YOLOv5 forward pass captured once into a CUDA Graph and replayed per image"""
+    
+    def __init__(self, net, img_size=IMG_SIZE):
+        self.net = net
+        self.conf = CANDIDATE_CONF
+        self.iou = CANDIDATE_IOU
+        self.max_det = MAX_NMS
+        
+        # The graph replays fixed device addresses, so the input buffer must persist
+        self.static_in = torch.zeros(1, 3, img_size, img_size, device='cuda', dtype=torch.half)
+        
+        with torch.inference_mode():
+            # Warm up on a side stream so lazy init stays out of the capture
+            stream = torch.cuda.Stream()
+            stream.wait_stream(torch.cuda.current_stream())
+            with torch.cuda.stream(stream):
+                for _ in range(3):
+                    self._forward(self.static_in)
+            torch.cuda.current_stream().wait_stream(stream)
+            
+            self.graph = torch.cuda.CUDAGraph()
+            with torch.cuda.graph(self.graph):
+                self.static_out = self._forward(self.static_in)
+    
+    def _forward(self, x):
+        out = self.net(x)
+        return out[0] if isinstance(out, (list, tuple)) else out
+    
+    @torch.inference_mode()
+    def __call__(self, image):
+        img = np.asarray(image)
+        tensor, ratio, pad = letterbox(img)
+        
+        # Upload the uint8 HWC array and normalize in place on the GPU
+        x = torch.from_numpy(tensor).to('cuda', non_blocking=True)
+        self.static_in.copy_(x.permute(2, 0, 1)[None]).div_(255.0)
+        self.graph.replay()
+        torch.cuda.synchronize()
+        pred = self.static_out.clone()
+        return Detections(postprocess(pred, self.conf, self.iou, ratio, pad, img.shape[:2], self.max_det))
+
+class InferenceWorker:
+    """Long-lived thread that owns the CUDA model and serves requests from a queue"""
+    
+    def __init__(self, build_model, *args):
+        # Streamlit runs every rerun on a fresh thread; a captured graph and its
+        # stream must stay on the one thread that created them
+        self.requests = queue.Queue()
+        ready = queue.Queue(maxsize=1)
+        self.thread = threading.Thread(target=self._loop, args=(build_model, args, ready), daemon=True)
+        self.thread.start()
+        
+        error = ready.get()
+        if error is not None:
+            raise error
+    
+    def _loop(self, build_model, args, ready):
+        # Any failure before the model exists must still reach __init__
+        try:
+            torch.cuda.set_device(0)
+            stream = torch.cuda.Stream()
+            with torch.cuda.stream(stream):
+                model = build_model(*args)
+        except Exception as e:
+            ready.put(e)
+            return
+        ready.put(None)
+        
+        with torch.cuda.stream(stream):
+            while True:
+                image, reply = self.requests.get()
+                try:
+                    result = model(image)
+                    # The caller reads the result on its own default stream
+                    stream.synchronize()
+                    reply.put(result)
+                except Exception as e:
+                    reply.put(e)
+    
+    def __call__(self, image):
+        reply = queue.Queue(maxsize=1)
+        self.requests.put((image, reply))
+        result = reply.get()
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+class ONNXRuntimeModel:
+    """YOLOv5 ONNX export served by ONNX Runtime's CUDA EP with CUDA Graph capture"""
+    
+    def __init__(self, onnx_path):
+        import onnxruntime as ort
+        
+        if 'CUDAExecutionProvider' not in ort.get_available_providers():
+            raise RuntimeError("onnxruntime was built without the CUDA execution provider")
+        
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(onnx_path, options, providers=[
+            ('CUDAExecutionProvider', {'enable_cuda_graph': True}),
+            'CPUExecutionProvider'
+        ])
+        
+        # Graph replay needs the input/output buffers at fixed device addresses
+        inp, out = self.session.get_inputs()[0], self.session.get_outputs()[0]
+        self.dtype = np.float16 if 'float16' in inp.type else np.float32
+        self.static_in = ort.OrtValue.ortvalue_from_numpy(np.zeros(inp.shape, dtype=self.dtype), 'cuda', 0)
+        self.static_out = ort.OrtValue.ortvalue_from_shape_and_type(out.shape, self.dtype, 'cuda', 0)
+        self.binding = self.session.io_binding()
+        self.binding.bind_ortvalue_input(inp.name, self.static_in)
+        self.binding.bind_ortvalue_output(out.name, self.static_out)
+        # The model is shared by every session; one request at a time owns the buffers
+        self.lock = threading.Lock()
+        
+        self.conf = CANDIDATE_CONF
+        self.iou = CANDIDATE_IOU
+        self.max_det = MAX_NMS
+    
+    def __call__(self, image):
+        img = np.asarray(image)
+        tensor, ratio, pad = letterbox(img)
+        
+        # update_inplace copies the raw buffer, so it must already be NCHW in memory
+        tensor = np.ascontiguousarray(tensor.transpose(2, 0, 1)[None], dtype=self.dtype)
+        tensor *= 1 / 255.0
+        with self.lock:
+            self.static_in.update_inplace(tensor)
+            self.session.run_with_iobinding(self.binding)
+            pred = self.static_out.numpy()
+        return Detections(postprocess(pred, self.conf, self.iou, ratio, pad, img.shape[:2], self.max_det))
+
+def yolov5_dir():
+    """Locate a YOLOv5 checkout (cloned by train.py or cached by torch.hub)"""
+    candidates = ['yolov5', os.path.join(torch.hub.get_dir(), 'ultralytics_yolov5_master')]
+    for path in candidates:
+        if os.path.exists(os.path.join(path, 'export.py')):
+            return path
+    return None
+
+def load_network(weights, device):
+    """Load YOLOv5 weights through DetectMultiBackend, skipping torch.hub when possible"""
+    repo = yolov5_dir()
+    
+    if repo is None:
+        # No checkout yet: torch.hub fetches one (and caches it for the next start)
+        hub_model = torch.hub.load('ultralytics/yolov5', 'custom', path=weights, device=device)
+        net = hub_model.model  # DetectMultiBackend underneath the AutoShape wrapper
+        if device.type == 'cuda':
+            net.half()
+            net.fp16 = True
+    else:
+        if repo not in sys.path:
+            sys.path.insert(0, repo)
+        from models.common import DetectMultiBackend
+        
+        # Half precision on GPU halves weight/activation memory traffic
+        net = DetectMultiBackend(weights, device=device, fp16=device.type == 'cuda')
+    
+    # Loaders already do this, but be explicit in case the backbone is swapped
+    net.eval()
+    return net
+
+def export_model(include, output_path, extra_args=(), weights='pcb_defect.pt'):
+    """Export the trained weights with YOLOv5's export.py once"""
+    if os.path.exists(output_path):
+        return True
+    
+    repo = yolov5_dir()
+    if repo is None:
+        return False
+    
+    try:
+        subprocess.run([
+            sys.executable, os.path.join(repo, 'export.py'),
+            '--weights', weights,
+            '--include', include,
+            '--imgsz', str(IMG_SIZE),
+            *extra_args
+        ], check=True)
+    except subprocess.CalledProcessError:
+        return False
+    
+    return os.path.exists(output_path)
+
 # Load model
 @st.cache_resource
 def load_model():
@@ -19,49 +329,95 @@ def load_model():
     try:
         # Try to load custom trained model first
         if os.path.exists('pcb_defect.pt'):
-            model = torch.hub.load('ultralytics/yolov5', 'custom', path='pcb_defect.pt')
+            weights = 'pcb_defect.pt'
+            
+            if torch.cuda.is_available():
+                # ONNX Runtime captures the whole exported graph into one CUDA Graph
+                onnx_args = ['--opset', '17', '--simplify', '--half', '--device', '0']
+                if export_model('onnx', ONNX_MODEL, onnx_args):
+                    try:
+                        return ONNXRuntimeModel(ONNX_MODEL)
+                    except ImportError:
+                        st.info("onnxruntime-gpu not installed, falling back to PyTorch inference")
+                    except Exception as e:
+                        st.info(f"ONNX Runtime unavailable, falling back to PyTorch inference: {str(e)}")
+            
+            # CPU deployments run much faster on the OpenVINO IR
+            elif export_model('openvino', OPENVINO_MODEL_XML):
+                try:
+                    return OpenVINOModel(OPENVINO_MODEL_XML)
+                except ImportError:
+                    st.info("OpenVINO not installed, falling back to PyTorch inference")
+                except Exception as e:
+                    st.info(f"OpenVINO unavailable, falling back to PyTorch inference: {str(e)}")
         else:
             # Fallback to pretrained model (you'll need to train your own)
             st.warning("Custom model not found. Please train your model first using train.py")
-            model = torch.hub.load('ultralytics/yolov5', 'yolov5s')
+            weights = 'yolov5s.pt'
+        
+        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        net = load_network(weights, device)
+        model = TorchModel(net, device)
+        
+        # Collapse the per-layer kernel launches into a single graph replay
+        if torch.cuda.is_available():
+            try:
+                model = InferenceWorker(CUDAGraphModel, net)
+            except Exception as e:
+                st.info(f"CUDA Graph capture failed, using eager inference: {str(e)}")
         
-        model.conf = 0.25  # confidence threshold
-        model.iou = 0.45   # IoU threshold
         return model
     except Exception as e:
         st.error(f"Error loading model: {str(e)}")
         return None
 
-def draw_detections(image, results):
-    """Draw bounding boxes and labels on the image"""
+def decode_image(data):
+    """Decode uploaded bytes into an RGB array using OpenCV's SIMD JPEG path"""
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+@st.cache_data(max_entries=32)
+def run_inference(image_bytes):
+    """Run the model once per uploaded image and keep every candidate box"""
+    model = load_model()
+    image = decode_image(image_bytes)
     
-    # Convert PIL to cv2
-    img_array = np.array(image)
-    img_cv2 = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
+    with torch.inference_mode():
+        results = model(image)
     
-    # Define class names and colors
-    class_names = ['missing_hole', 'mouse_bite', 'open_circuit', 'short', 'spur', 'spurious_copper']
-    colors = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 0), (255, 0, 255), (0, 255, 255)]
+    return results.xyxy[0].cpu().numpy().astype(np.float32)
+
+def filter_detections(det, conf_thres, iou_thres):
+    """Apply the sidebar confidence and IoU thresholds to cached candidates"""
+    det = det[det[:, 4] >= conf_thres]
     
-    # Extract detections
-    detections = results.pandas().xyxy[0]
+    # Class-aware NMS, matching what YOLOv5 does internally
+    boxes = torch.from_numpy(det[:, :4])
+    scores = torch.from_numpy(det[:, 4])
+    classes = torch.from_numpy(det[:, 5]).long()
+    keep = torchvision.ops.batched_nms(boxes, scores, classes, iou_thres)[:MAX_DET]
+    return det[keep.numpy()]
+
+def draw_detections(image, det):
+    """Draw bounding boxes and labels from an (N, 6) x1, y1, x2, y2, conf, class array"""
     
-    for _, detection in detections.iterrows():
-        x1, y1, x2, y2 = int(detection['xmin']), int(detection['ymin']), int(detection['xmax']), int(detection['ymax'])
-        conf = detection['confidence']
-        cls = int(detection['class'])
-        
+    # Draw straight onto a copy of the RGB array; COLORS are RGB tuples already
+    img_array = np.array(image)
+    
+    boxes = det[:, :4].astype(np.int32)
+    confs = det[:, 4]
+    classes = det[:, 5].astype(np.int32)
+    box_colors = COLORS[classes % len(COLORS)].tolist()
+    
+    for (x1, y1, x2, y2), conf, cls, color in zip(boxes.tolist(), confs, classes, box_colors):
         # Draw bounding box
-        color = colors[cls % len(colors)]
-        cv2.rectangle(img_cv2, (x1, y1), (x2, y2), color, 2)
+        cv2.rectangle(img_array, (x1, y1), (x2, y2), color, 2)
         
         # Draw label
-        label = f"{class_names[cls]}: {conf:.2f}"
-        cv2.putText(img_cv2, label, (x1, y1-10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+        label = f"{CLASS_NAMES[cls]}: {conf:.2f}"
+        cv2.putText(img_array, label, (x1, y1-10), FONT, 0.5, color, 2)
     
-    # Convert back to PIL
-    img_rgb = cv2.cvtColor(img_cv2, cv2.COLOR_BGR2RGB)
-    return Image.fromarray(img_rgb)
+    return Image.fromarray(img_array)
 
 def main():
     st.title("🔍 InspectPCB")
@@ -77,10 +433,6 @@ def main():
     if model is None:
         st.stop()
     
-    # Update model thresholds
-    model.conf = confidence_threshold
-    model.iou = iou_threshold
-    
     # Main content
     col1, col2 = st.columns([1, 1])
     
@@ -93,33 +445,34 @@ def main():
         )
         
         if uploaded_file:
-            image = Image.open(uploaded_file).convert("RGB")
+            image = decode_image(uploaded_file.getvalue())
             st.image(image, caption="Uploaded PCB Image", use_column_width=True)
     
     with col2:
         st.header("Detection Results")
         
         if uploaded_file and st.button("🔍 Detect Defects", type="primary"):
+            # Remember the request so slider changes re-filter instead of clearing the results
+            st.session_state.detected_file = (uploaded_file.name, uploaded_file.size)
+        
+        if uploaded_file and st.session_state.get('detected_file') == (uploaded_file.name, uploaded_file.size):
             with st.spinner("Analyzing PCB for defects..."):
                 try:
-                    # Run inference
-                    results = model(image)
-                    
-                    # Get detection count
-                    detections = results.pandas().xyxy[0]
-                    num_detections = len(detections)
+                    # The forward pass is cached per image; moving a slider only re-filters
+                    candidates = run_inference(uploaded_file.getvalue())
+                    det = filter_detections(candidates, confidence_threshold, iou_threshold)
+                    num_detections = len(det)
                     
                     if num_detections > 0:
                         # Draw detections
-                        result_image = draw_detections(image, results)
+                        result_image = draw_detections(image, det)
                         st.image(result_image, caption=f"Detected {num_detections} defect(s)", use_column_width=True)
                         
                         # Show detection details
                         st.subheader("Defect Details")
-                        for i, (_, detection) in enumerate(detections.iterrows()):
-                            class_names = ['missing_hole', 'mouse_bite', 'open_circuit', 'short', 'spur', 'spurious_copper']
-                            defect_type = class_names[int(detection['class'])]
-                            confidence = detection['confidence']
+                        for i, row in enumerate(det):
+                            defect_type = CLASS_NAMES[int(row[5])]
+                            confidence = float(row[4])
                             
                             st.write(f"**Defect {i+1}:** {defect_type} (Confidence: {confidence:.2%})")
                     else:
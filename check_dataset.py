@@ -22,7 +22,7 @@ def check_dataset():
     
     for dir_path in dirs_to_check:
         if os.path.exists(dir_path):
-            files = os.listdir(dir_path)
+            files = [e.name for e in os.scandir(dir_path)]
             print(f"✅ {dir_path}: {len(files)} files")
             
             # Show first few files as examples
@@ -38,12 +38,11 @@ def check_dataset():
     # Check if we have any PCB groups
     if os.path.exists('DeepPCB/PCBData'):
         print(f"\n📁 PCBData Groups:")
-        groups = [d for d in os.listdir('DeepPCB/PCBData') if d.startswith('group')]
+        groups = [e for e in os.scandir('DeepPCB/PCBData') if e.name.startswith('group')]
         for group in groups[:5]:  # Show first 5 groups
-            group_path = os.path.join('DeepPCB/PCBData', group)
-            if os.path.isdir(group_path):
-                subdirs = os.listdir(group_path)
-                print(f"   {group}: {subdirs}")
+            if group.is_dir():
+                subdirs = [e.name for e in os.scandir(group.path)]
+                print(f"   {group.name}: {subdirs}")
     
     # Check dataset.yaml
     if os.path.exists('dataset.yaml'):
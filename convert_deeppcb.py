@@ -1,8 +1,13 @@
 import os
-import glob
-import shutil
-from PIL import Image
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from dataset_utils import materialize, get_image_size, read_boxes
+
+# How often to re-read a file's real size to confirm a group is uniform
+SIZE_CHECK_INTERVAL = 50
+
+YOLO_ROW_FORMAT = "%d %.6f %.6f %.6f %.6f\n"
 
 def collect_deeppcb_dataset():
     """Collect all DeepPCB test images and annotations correctly"""
@@ -22,18 +27,17 @@ def collect_deeppcb_dataset():
         print("❌ PCBData directory not found!")
         return False
     
-    group_dirs = [d for d in os.listdir(pcb_data_dir) 
-                  if d.startswith('group') and os.path.isdir(os.path.join(pcb_data_dir, d))]
+    group_dirs = [e.name for e in os.scandir(pcb_data_dir)
+                  if e.name.startswith('group') and e.is_dir()]
     
-    total_processed = 0
-    total_converted = 0
+    work_items = []
     
     for group_dir in group_dirs:
         group_path = os.path.join(pcb_data_dir, group_dir)
         print(f"📁 Processing {group_dir}...")
         
         # Look for the image directory (without _not suffix)
-        subdirs = [d for d in os.listdir(group_path) if os.path.isdir(os.path.join(group_path, d))]
+        subdirs = [e.name for e in os.scandir(group_path) if e.is_dir()]
         
         image_subdir = None
         annotation_subdir = None
@@ -49,7 +53,13 @@ def collect_deeppcb_dataset():
             continue
         
         # Get all annotation files
-        annotation_files = glob.glob(os.path.join(annotation_subdir, '*.txt'))
+        annotation_files = [e.path for e in os.scandir(annotation_subdir)
+                            if e.name.endswith('.txt') and e.is_file()]
+        
+        # DeepPCB images share one resolution per group, so probe it only once
+        group_image_size = None
+        group_count = 0
+        mixed_sizes = False
         
         for ann_file in annotation_files:
             base_name = os.path.splitext(os.path.basename(ann_file))[0]
@@ -69,64 +79,78 @@ def collect_deeppcb_dataset():
                     print(f"  ⚠️  No test image found for {base_name}")
                     continue
             
-            # Copy the test image with a unique name
+            # Unique destination names for the test image and its label
             unique_image_name = f"{group_dir}_{os.path.basename(test_image_path)}"
             dest_image_path = os.path.join(unified_image_dir, unique_image_name)
-            shutil.copy2(test_image_path, dest_image_path)
-            
-            # Convert the annotation
             unique_label_name = f"{group_dir}_{base_name}.txt"
             dest_label_path = os.path.join(unified_labels_dir, unique_label_name)
             
-            if convert_annotation_file(ann_file, test_image_path, dest_label_path):
-                total_converted += 1
+            # Spot-check the group size while queueing, and read every header
+            # (cached) for the rest of the group once it turns out to mix sizes
+            check_size = group_count > 0 and group_count % SIZE_CHECK_INTERVAL == 0
+            group_count += 1
+            try:
+                if mixed_sizes:
+                    image_size = get_image_size(test_image_path)
+                elif group_image_size is None:
+                    image_size = group_image_size = get_image_size(test_image_path)
+                else:
+                    image_size = group_image_size
+                    if check_size and get_image_size(test_image_path) != group_image_size:
+                        print(f"  ⚠️  {group_dir} mixes image sizes, reading each header")
+                        mixed_sizes = True
+                        image_size = get_image_size(test_image_path)
+            except Exception as e:
+                print(f"  ⚠️  Could not read {test_image_path}: {e}")
+                continue
             
-            total_processed += 1
+            work_items.append((ann_file, test_image_path, dest_image_path, dest_label_path, image_size))
+    
+    # Each item writes to its own destination, so the I/O-bound work can overlap freely
+    with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as executor:
+        results = list(executor.map(process_annotation, work_items))
+    
+    total_processed = len(results)
+    total_converted = sum(results)
     
     print(f"✅ Processed {total_processed} files, converted {total_converted} successfully")
     return total_converted > 0
 
-def convert_annotation_file(annotation_file, image_file, output_file):
+def process_annotation(work_item):
+    """Link one test image into place and convert its annotation"""
+    ann_file, test_image_path, dest_image_path, dest_label_path, image_size = work_item
+    
+    # Hardlink the test image (same filesystem, no byte copy)
+    if not os.path.exists(dest_image_path):
+        materialize(test_image_path, dest_image_path)
+    
+    return convert_annotation_file(ann_file, image_size, dest_label_path)
+
+def convert_annotation_file(annotation_file, image_size, output_file):
     """Convert a single annotation file to YOLO format"""
     
     try:
-        # Get image dimensions
-        img = Image.open(image_file)
-        w, h = img.size
+        w, h = image_size
         
-        # Read and convert annotations
-        with open(annotation_file, 'r') as f_in, open(output_file, 'w') as f_out:
-            for line in f_in:
-                line = line.strip()
-                if not line:
-                    continue
-                
-                try:
-                    # Parse DeepPCB format: x1,y1,x2,y2,class_id
-                    # or space-separated: x1 y1 x2 y2 class_id
-                    if ',' in line:
-                        parts = line.split(',')
-                    else:
-                        parts = line.split()
-                    
-                    if len(parts) >= 5:
-                        x1, y1, x2, y2, class_id = map(int, parts[:5])
-                        
-                        # Convert to YOLO format (normalized center coordinates)
-                        center_x = ((x1 + x2) / 2) / w
-                        center_y = ((y1 + y2) / 2) / h
-                        bbox_width = (x2 - x1) / w
-                        bbox_height = (y2 - y1) / h
-                        
-                        # DeepPCB uses 1-6 class IDs, convert to 0-5 for YOLO
-                        if class_id > 0:
-                            class_id -= 1
-                        
-                        f_out.write(f"{class_id} {center_x:.6f} {center_y:.6f} {bbox_width:.6f} {bbox_height:.6f}\n")
-                        
-                except (ValueError, IndexError) as e:
-                    print(f"    ⚠️  Error parsing line '{line}': {e}")
-                    continue
+        # Parse DeepPCB format: x1,y1,x2,y2,class_id
+        # or space-separated: x1 y1 x2 y2 class_id
+        raw = read_boxes(annotation_file)
+        
+        # Convert to YOLO format (normalized center coordinates) for every box at once
+        x1, y1, x2, y2, class_id = raw.T
+        center_x = (x1 + x2) / 2 / w
+        center_y = (y1 + y2) / 2 / h
+        bbox_width = (x2 - x1) / w
+        bbox_height = (y2 - y1) / h
+        
+        # DeepPCB uses 1-6 class IDs, convert to 0-5 for YOLO
+        class_id = np.where(class_id > 0, class_id - 1, class_id)
+        
+        out = np.column_stack([class_id, center_x, center_y, bbox_width, bbox_height])
+        
+        # np.savetxt writes row by row; format everything and emit a single write
+        with open(output_file, 'w') as f_out:
+            f_out.write(''.join(YOLO_ROW_FORMAT % tuple(row) for row in out.tolist()))
         
         return True
         
@@ -146,8 +170,8 @@ def verify_conversion():
         print("❌ Conversion directories not found!")
         return False
     
-    image_files = glob.glob(os.path.join(image_dir, '*'))
-    label_files = glob.glob(os.path.join(label_dir, '*.txt'))
+    image_files = [e.path for e in os.scandir(image_dir)]
+    label_files = [e.path for e in os.scandir(label_dir) if e.name.endswith('.txt') and e.is_file()]
     
     print(f"📊 Conversion results:")
     print(f"   🖼️  Images: {len(image_files)}")
@@ -0,0 +1,140 @@
+import os
+import errno
+import shutil
+import tempfile
+import functools
+import struct
+import io
+import mmap
+import numpy as np
+from PIL import Image
+
+# Link errors that mean "this filesystem can't do that"; anything else
+# (EEXIST in particular) is a real problem and must not turn into a copy
+LINK_UNSUPPORTED = {errno.EXDEV, errno.EPERM, errno.EACCES, errno.EMLINK,
+                    errno.ENOTSUP, errno.EOPNOTSUPP}
+
+def materialize(src, dst):
+    """Place src at dst without copying bytes when possible"""
+    # Replace any previous output so a stale link never gets written through
+    try:
+        os.remove(dst)
+    except FileNotFoundError:
+        pass
+    
+    try:
+        os.link(src, dst)  # hardlink: one syscall, no data movement
+        return
+    except OSError as e:
+        if e.errno not in LINK_UNSUPPORTED:
+            raise
+    
+    try:
+        os.symlink(os.path.abspath(src), dst)
+        return
+    except OSError as e:
+        if e.errno not in LINK_UNSUPPORTED:
+            raise
+    
+    fastcopy(src, dst)
+
+def fastcopy(src, dst):
+    """Copy file data in-kernel with os.sendfile, then the metadata"""
+    # Write to a fresh file and rename it into place, so an existing dst
+    # (possibly a hardlink to the source) is replaced rather than truncated
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dst) or '.', suffix='.tmp')
+    try:
+        try:
+            with open(src, 'rb') as fsrc, os.fdopen(fd, 'wb') as fdst:
+                offset = 0
+                remaining = os.fstat(fsrc.fileno()).st_size
+                while remaining > 0:
+                    sent = os.sendfile(fdst.fileno(), fsrc.fileno(), offset, remaining)
+                    if sent == 0:
+                        break
+                    offset += sent
+                    remaining -= sent
+            shutil.copystat(src, tmp)
+        except (AttributeError, OSError):
+            # No sendfile (Windows) or not file-to-file capable (macOS)
+            shutil.copy2(src, tmp)
+        os.replace(tmp, dst)
+    except BaseException:
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        raise
+
+# The raw images are read-only while converting, so sizes can be cached by path
+@functools.lru_cache(maxsize=4096)
+def get_image_size(img_file):
+    """Read (width, height) from the JPEG/PNG header without building a PIL image"""
+    size = None
+    with open(img_file, 'rb') as f:
+        # Map the file so the header pages are served from the page cache, and
+        # PIL below never reads past them unless it has to; an empty file
+        # cannot be mapped and is left for PIL to reject
+        data = b''
+        if os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                data = mm[:65536]
+    
+    try:
+        # PNG: width and height sit in the IHDR chunk at a fixed offset
+        if data[:8] == b'\x89PNG\r\n\x1a\n':
+            size = struct.unpack('>II', data[16:24])
+        
+        # JPEG: walk the marker segments until the first SOF0-SOF3
+        elif data[:2] == b'\xff\xd8':
+            idx = 2
+            while idx + 9 <= len(data) and data[idx] == 0xFF:
+                marker = data[idx + 1]
+                if marker == 0xFF:
+                    idx += 1
+                    continue
+                if 0xC0 <= marker <= 0xC3:
+                    h, w = struct.unpack('>HH', data[idx + 5:idx + 9])
+                    size = (w, h)
+                    break
+                idx += 2 + struct.unpack('>H', data[idx + 2:idx + 4])[0]
+    except struct.error:
+        pass
+    
+    # Unusual layout or format - let PIL work it out from the mapped header
+    if size is None:
+        try:
+            with Image.open(io.BytesIO(data)) as img:
+                size = img.size
+        except OSError:
+            # Header larger than 64 KiB - hand PIL the whole file
+            with Image.open(img_file) as img:
+                size = img.size
+    
+    return size
+
+def read_boxes(ann_file):
+    """Parse a DeepPCB annotation into an (N, 5) int array of x1, y1, x2, y2, class"""
+    # Annotations are plain ASCII numbers, so skip the text decode layer;
+    # int() parses bytes directly
+    with open(ann_file, 'rb') as f:
+        data = f.read()
+    
+    # Lines are comma- or space-separated (sometimes both); a short or
+    # malformed line only loses its own box, not the whole file
+    rows = []
+    for line in data.split(b'\n'):
+        parts = line.replace(b',', b' ').split()
+        if len(parts) < 5:
+            continue
+        try:
+            rows.append([int(v) for v in parts[:5]])
+        except ValueError:
+            continue
+    return np.array(rows, dtype=np.int64).reshape(-1, 5)
+
+def count_files(dir_path):
+    """Count directory entries in one scandir pass; -1 if the directory is missing"""
+    try:
+        with os.scandir(dir_path) as it:
+            return sum(1 for _ in it)
+    except FileNotFoundError:
+        return -1
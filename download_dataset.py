@@ -4,17 +4,19 @@ import sys
 import shutil
 from pathlib import Path
 
-def run_command(command, cwd=None):
-    """Run a shell command and return the result"""
+def run_command(argv, cwd=None):
+    """Run a command (argument list, no shell) and return whether it succeeded"""
     try:
-        result = subprocess.run(command, shell=True, cwd=cwd, capture_output=True, text=True)
+        # Only stderr is kept so large clone logs are not buffered
+        result = subprocess.run(argv, cwd=cwd, check=False, text=True,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
         if result.returncode != 0:
-            print(f"Error running command: {command}")
+            print(f"Error running command: {' '.join(argv)}")
             print(f"Error output: {result.stderr}")
             return False
         return True
     except Exception as e:
-        print(f"Exception running command {command}: {e}")
+        print(f"Exception running command {' '.join(argv)}: {e}")
         return False
 
 def download_deeppcb_dataset():
@@ -23,7 +25,7 @@ def download_deeppcb_dataset():
     print("🔄 Starting DeepPCB dataset download...")
     
     # Check if git is available
-    if not run_command("git --version"):
+    if not run_command(['git', '--version']):
         print("❌ Git is not installed or not available in PATH")
         print("Please install Git first: https://git-scm.com/downloads")
         return False
@@ -35,7 +37,7 @@ def download_deeppcb_dataset():
     
     # Clone the repository
     print("📥 Cloning DeepPCB repository...")
-    clone_command = "git clone https://github.com/tangsanli5201/DeepPCB.git"
+    clone_command = ['git', 'clone', '--depth', '1', 'https://github.com/tangsanli5201/DeepPCB.git']
     
     if not run_command(clone_command):
         print("❌ Failed to clone repository")
@@ -59,11 +61,11 @@ def download_deeppcb_dataset():
                 print(f"  📁 {item.name}/")
                 # Show contents of subdirectories
                 try:
-                    sub_items = list(item.iterdir())[:5]  # Show first 5 items
-                    for sub_item in sub_items:
+                    sub_items = list(item.iterdir())
+                    for sub_item in sub_items[:5]:  # Show first 5 items
                         print(f"    - {sub_item.name}")
-                    if len(list(item.iterdir())) > 5:
-                        print(f"    ... and {len(list(item.iterdir())) - 5} more items")
+                    if len(sub_items) > 5:
+                        print(f"    ... and {len(sub_items) - 5} more items")
                 except:
                     pass
             else:
@@ -144,4 +146,4 @@ if __name__ == "__main__":
         print("   - Click 'Code' > 'Download ZIP'")
         print("   - Extract to your project directory")
         print("\n2. Direct git clone:")
-        print("   git clone https://github.com/tangsanli5201/DeepPCB.git")
\ No newline at end of file
+        print("   git clone --depth 1 https://github.com/tangsanli5201/DeepPCB.git")
\ No newline at end of file
@@ -1,9 +1,20 @@
 import os
 import glob
-import shutil
-import random
-from PIL import Image
+import numpy as np
+import multiprocessing
 from pathlib import Path
+from dataset_utils import materialize, get_image_size, read_boxes, count_files
+
+# numba is optional; without it the box conversion runs as plain NumPy
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+YOLO_ROW_FORMAT = "%d %.6f %.6f %.6f %.6f\n"
+
+# Images in a group share one resolution; re-read a header this often to confirm
+SIZE_CHECK_INTERVAL = 50
 
 def step1_analyze_raw_data():
     """Analyze the raw DeepPCB data structure"""
@@ -17,20 +28,22 @@ def step1_analyze_raw_data():
         return False
     
     # Find all groups
-    groups = [d for d in os.listdir('DeepPCB/PCBData') if d.startswith('group')]
+    with os.scandir('DeepPCB/PCBData') as it:
+        groups = [e.name for e in it if e.is_dir(follow_symlinks=False) and e.name.startswith('group')]
     print(f"📁 Found {len(groups)} groups: {groups[:3]}...")
     
     # Analyze first group structure
     if groups:
         first_group = os.path.join('DeepPCB/PCBData', groups[0])
-        subdirs = os.listdir(first_group)
-        print(f"📂 Sample group structure ({groups[0]}): {subdirs}")
+        with os.scandir(first_group) as it:
+            entries = list(it)
+        print(f"📂 Sample group structure ({groups[0]}): {[e.name for e in entries]}")
         
-        for subdir in subdirs:
-            subdir_path = os.path.join(first_group, subdir)
-            if os.path.isdir(subdir_path):
-                files = os.listdir(subdir_path)
-                print(f"   {subdir}: {len(files)} files")
+        for entry in entries:
+            if entry.is_dir():
+                with os.scandir(entry.path) as it:
+                    files = [e.name for e in it]
+                print(f"   {entry.name}: {len(files)} files")
                 if files:
                     # Show file types
                     extensions = set(os.path.splitext(f)[1].lower() for f in files[:10])
@@ -43,145 +56,181 @@ def step2_collect_and_convert():
     print("\n🔄 STEP 2: Collecting and converting data...")
     
     # Create output directories
-    os.makedirs('DeepPCB/unified_images', exist_ok=True)
-    os.makedirs('DeepPCB/unified_labels', exist_ok=True)
+    os.makedirs('DeepPCB/images/unified', exist_ok=True)
+    os.makedirs('DeepPCB/labels/unified', exist_ok=True)
     
-    groups = [d for d in os.listdir('DeepPCB/PCBData') if d.startswith('group')]
+    with os.scandir('DeepPCB/PCBData') as it:
+        groups = [e.name for e in it if e.is_dir(follow_symlinks=False) and e.name.startswith('group')]
     total_images = 0
     total_labels = 0
     
-    for group in groups:
-        print(f"📁 Processing {group}...")
-        group_path = os.path.join('DeepPCB/PCBData', group)
+    # Groups are large and independent: one group per task keeps the
+    # inter-process traffic down to a name going out and two counts coming back
+    with multiprocessing.Pool(max(1, min(len(groups), os.cpu_count() or 1))) as pool:
+        for n_images, n_labels in pool.imap_unordered(process_group, groups, chunksize=1):
+            total_images += n_images
+            total_labels += n_labels
+    
+    print(f"✅ Collected {total_images} images and {total_labels} labels")
+    return total_images > 0
+
+def process_group(group):
+    """Collect and convert one PCBData group, returning (images, labels) counts"""
+    print(f"📁 Processing {group}...")
+    group_path = os.path.join('DeepPCB/PCBData', group)
+    
+    # Find subdirectories
+    image_dir = None
+    annotation_dir = None
+    
+    with os.scandir(group_path) as it:
+        for entry in it:
+            if not entry.is_dir():
+                continue
+            if entry.name.endswith('_not'):
+                annotation_dir = entry.path
+            else:
+                image_dir = entry.path
+    
+    if not image_dir or not annotation_dir:
+        print(f"   ⚠️ Skipping {group} - missing directories")
+        return 0, 0
+    
+    # Process all annotation files
+    annotation_files = glob.glob(os.path.join(annotation_dir, '*.txt'))
+    print(f"   📄 {group}: found {len(annotation_files)} annotation files")
+    
+    # Index the image directory once instead of probing candidates one by one
+    with os.scandir(image_dir) as it:
+        image_index = {e.name: e.path for e in it if e.is_file()}
+    
+    converted = 0
+    seen = 0
+    group_size = None
+    mixed_sizes = False
+    for ann_file in annotation_files:
+        base_name = os.path.splitext(os.path.basename(ann_file))[0]
         
-        # Find subdirectories
-        subdirs = [d for d in os.listdir(group_path) if os.path.isdir(os.path.join(group_path, d))]
+        # Look for test image
+        test_image_names = [
+            f"{base_name}_test.jpg",
+            f"{base_name}_test.png",
+            f"{base_name}.jpg",
+            f"{base_name}.png"
+        ]
         
-        image_dir = None
-        annotation_dir = None
+        found_image = next((image_index[n] for n in test_image_names if n in image_index), None)
+        if not found_image:
+            continue
         
-        for subdir in subdirs:
-            if subdir.endswith('_not'):
-                annotation_dir = os.path.join(group_path, subdir)
+        # Read one header per group; spot-check it, and fall back to
+        # per-image sizes if the group turns out to mix resolutions
+        check_size = seen > 0 and seen % SIZE_CHECK_INTERVAL == 0
+        seen += 1
+        try:
+            if mixed_sizes:
+                image_size = get_image_size(found_image)
+            elif group_size is None:
+                image_size = group_size = get_image_size(found_image)
             else:
-                image_dir = os.path.join(group_path, subdir)
-        
-        if not image_dir or not annotation_dir:
-            print(f"   ⚠️ Skipping {group} - missing directories")
+                image_size = group_size
+                if check_size and get_image_size(found_image) != group_size:
+                    print(f"   ⚠️ {group} mixes image sizes, reading each header")
+                    mixed_sizes = True
+                    image_size = get_image_size(found_image)
+        except Exception as e:
+            # Corrupt images can fail in PIL with more than OSError;
+            # skip the image rather than abort the whole pool
+            print(f"   ❌ Could not read {found_image}: {e}")
             continue
         
-        # Process all annotation files
-        annotation_files = glob.glob(os.path.join(annotation_dir, '*.txt'))
-        print(f"   📄 Found {len(annotation_files)} annotation files")
-        
-        for ann_file in annotation_files:
-            base_name = os.path.splitext(os.path.basename(ann_file))[0]
-            
-            # Look for test image
-            test_image_patterns = [
-                os.path.join(image_dir, f"{base_name}_test.jpg"),
-                os.path.join(image_dir, f"{base_name}_test.png"),
-                os.path.join(image_dir, f"{base_name}.jpg"), 
-                os.path.join(image_dir, f"{base_name}.png")
-            ]
-            
-            found_image = None
-            for pattern in test_image_patterns:
-                if os.path.exists(pattern):
-                    found_image = pattern
-                    break
-            
-            if not found_image:
-                continue
-            
-            # Copy image with unique name
-            unique_name = f"{group}_{base_name}"
-            dest_image = os.path.join('DeepPCB/unified_images', f"{unique_name}.jpg")
-            dest_label = os.path.join('DeepPCB/unified_labels', f"{unique_name}.txt")
-            
-            # Copy image
-            shutil.copy2(found_image, dest_image)
-            
-            # Convert annotation
-            if convert_annotation(ann_file, found_image, dest_label):
-                total_images += 1
-                total_labels += 1
+        converted += process_annotation(ann_file, group, found_image, image_size)
     
-    print(f"✅ Collected {total_images} images and {total_labels} labels")
-    return total_images > 0
+    return converted, converted
 
-def convert_annotation(ann_file, img_file, output_file):
-    """Convert single annotation to YOLO format"""
+def process_annotation(ann_file, group, found_image, image_size):
+    """Link one test image into the unified set and convert its annotation"""
+    base_name = os.path.splitext(os.path.basename(ann_file))[0]
+    unique_name = f"{group}_{base_name}"
+    
+    # Unique destination names
+    dest_image = os.path.join('DeepPCB/images/unified', f"{unique_name}.jpg")
+    dest_label = os.path.join('DeepPCB/labels/unified', f"{unique_name}.txt")
+    
+    # Link image into place
+    materialize(found_image, dest_image)
+    
+    # Convert annotation
+    w, h = image_size
+    return convert_annotation(ann_file, w, h, dest_label)
+
+def to_yolo_numpy(raw, inv_w, inv_h):
+    """Convert (N, 5) x1, y1, x2, y2, class rows to YOLO class, cx, cy, w, h"""
+    out = np.empty((raw.shape[0], 5))
+    
+    # Adjust class ID (DeepPCB uses 1-6, YOLO needs 0-5)
+    out[:, 0] = np.where(raw[:, 4] > 0, raw[:, 4] - 1, raw[:, 4])
+    out[:, 1] = (raw[:, 0] + raw[:, 2]) * (0.5 * inv_w)
+    out[:, 2] = (raw[:, 1] + raw[:, 3]) * (0.5 * inv_h)
+    out[:, 3] = (raw[:, 2] - raw[:, 0]) * inv_w
+    out[:, 4] = (raw[:, 3] - raw[:, 1]) * inv_h
+    return out
+
+def to_yolo_loop(raw, inv_w, inv_h):
+    """Single-pass version of to_yolo_numpy for numba to compile"""
+    out = np.empty((raw.shape[0], 5))
+    for i in range(raw.shape[0]):
+        x1, y1, x2, y2, class_id = raw[i, 0], raw[i, 1], raw[i, 2], raw[i, 3], raw[i, 4]
+        out[i, 0] = class_id - 1 if class_id > 0 else class_id
+        out[i, 1] = (x1 + x2) * (0.5 * inv_w)
+        out[i, 2] = (y1 + y2) * (0.5 * inv_h)
+        out[i, 3] = (x2 - x1) * inv_w
+        out[i, 4] = (y2 - y1) * inv_h
+    return out
+
+to_yolo = njit(cache=True, fastmath=True)(to_yolo_loop) if njit else to_yolo_numpy
+
+def convert_annotation(ann_file, w, h, output_file):
+    """Convert single annotation to YOLO format for a w x h image"""
     try:
-        img = Image.open(img_file)
-        w, h = img.size
+        raw = read_boxes(ann_file)
         
-        with open(ann_file, 'r') as f_in, open(output_file, 'w') as f_out:
-            for line in f_in:
-                line = line.strip()
-                if not line:
-                    continue
-                
-                # Try different formats
-                if ',' in line:
-                    parts = line.split(',')
-                else:
-                    parts = line.split()
-                
-                if len(parts) >= 5:
-                    try:
-                        x1, y1, x2, y2, class_id = map(int, parts[:5])
-                        
-                        # Convert to YOLO format
-                        center_x = ((x1 + x2) / 2) / w
-                        center_y = ((y1 + y2) / 2) / h
-                        bbox_width = (x2 - x1) / w
-                        bbox_height = (y2 - y1) / h
-                        
-                        # Adjust class ID (DeepPCB uses 1-6, YOLO needs 0-5)
-                        if class_id > 0:
-                            class_id -= 1
-                        
-                        f_out.write(f"{class_id} {center_x:.6f} {center_y:.6f} {bbox_width:.6f} {bbox_height:.6f}\n")
-                    except ValueError:
-                        continue
+        # Convert to YOLO format; the reciprocals keep divisions out of the kernel
+        out = to_yolo(raw, 1.0 / w, 1.0 / h)
+        
+        # np.savetxt writes row by row; format everything and emit a single write
+        with open(output_file, 'wb') as f_out:
+            f_out.write(''.join(YOLO_ROW_FORMAT % tuple(row) for row in out.tolist()).encode('ascii'))
         return True
     except Exception as e:
         print(f"   ❌ Error converting {ann_file}: {e}")
         return False
 
-def step3_split_dataset():
+def step3_split_dataset(seed=42):
     """Split unified dataset into train/val/test"""
     print("\n📊 STEP 3: Splitting dataset...")
     
-    # Create directories
-    splits = ['train', 'val', 'test']
-    for split in splits:
-        os.makedirs(f'DeepPCB/images/{split}', exist_ok=True)
-        os.makedirs(f'DeepPCB/labels/{split}', exist_ok=True)
-    
-    # Get all unified files
-    image_files = glob.glob('DeepPCB/unified_images/*.jpg')
+    # Get all unified files, keyed by basename
+    with os.scandir('DeepPCB/images/unified') as it:
+        images = {os.path.splitext(e.name)[0]: e.path for e in it if e.name.endswith('.jpg')}
     
-    if not image_files:
+    if not images:
         print("❌ No unified images found!")
         return False
     
-    print(f"📷 Found {len(image_files)} images to split")
+    print(f"📷 Found {len(images)} images to split")
     
-    # Create matched pairs
-    valid_pairs = []
-    for img_file in image_files:
-        base_name = os.path.splitext(os.path.basename(img_file))[0]
-        label_file = f'DeepPCB/unified_labels/{base_name}.txt'
-        
-        if os.path.exists(label_file):
-            valid_pairs.append((img_file, label_file))
+    with os.scandir('DeepPCB/labels/unified') as it:
+        labels = {os.path.splitext(e.name)[0]: e.path for e in it if e.name.endswith('.txt')}
+    
+    # Create matched pairs; sorted so the seeded shuffle sees a stable order
+    valid_pairs = [(images[k], labels[k]) for k in sorted(images.keys() & labels.keys())]
     
     print(f"📋 Found {len(valid_pairs)} valid image-label pairs")
     
-    # Shuffle and split
-    random.shuffle(valid_pairs)
+    # Shuffle (seeded, so reruns give the same split) and split
+    idx = np.random.default_rng(seed).permutation(len(valid_pairs))
+    valid_pairs = [valid_pairs[i] for i in idx]
     
     train_end = int(len(valid_pairs) * 0.7)
     val_end = int(len(valid_pairs) * 0.9)
@@ -192,18 +241,13 @@ def step3_split_dataset():
         'test': valid_pairs[val_end:]
     }
     
-    # Copy files
+    # YOLOv5 accepts a txt list of image paths per split and maps
+    # images/ -> labels/ itself, so write manifests instead of linking files
     for split_name, pairs in splits_data.items():
         print(f"📁 {split_name}: {len(pairs)} pairs")
         
-        for img_path, label_path in pairs:
-            # Copy image
-            img_dest = os.path.join(f'DeepPCB/images/{split_name}', os.path.basename(img_path))
-            shutil.copy2(img_path, img_dest)
-            
-            # Copy label
-            label_dest = os.path.join(f'DeepPCB/labels/{split_name}', os.path.basename(label_path))
-            shutil.copy2(label_path, label_dest)
+        with open(f'DeepPCB/{split_name}.txt', 'w') as f:
+            f.write(''.join(os.path.abspath(img_path) + '\n' for img_path, _ in pairs))
     
     return True
 
@@ -213,9 +257,9 @@ def step4_create_yaml():
     
     yaml_content = f"""# DeepPCB Dataset Configuration
 path: {str(Path.cwd() / 'DeepPCB')}
-train: images/train
-val: images/val  
-test: images/test
+train: train.txt
+val: val.txt
+test: test.txt
 
 # Classes
 nc: 6
@@ -238,23 +282,35 @@ def step5_verify():
     print("\n✅ STEP 5: Final verification...")
     
     required_dirs = [
-        'DeepPCB/images/train',
-        'DeepPCB/images/val',
-        'DeepPCB/images/test', 
-        'DeepPCB/labels/train',
-        'DeepPCB/labels/val',
-        'DeepPCB/labels/test'
+        'DeepPCB/images/unified',
+        'DeepPCB/labels/unified'
+    ]
+    required_manifests = [
+        'DeepPCB/train.txt',
+        'DeepPCB/val.txt',
+        'DeepPCB/test.txt'
     ]
     
     all_good = True
     for dir_path in required_dirs:
-        if os.path.exists(dir_path):
-            count = len(os.listdir(dir_path))
+        count = count_files(dir_path)
+        if count < 0:
+            print(f"❌ {dir_path}: Missing!")
+            all_good = False
+        else:
             print(f"✅ {dir_path}: {count} files")
             if count == 0:
                 all_good = False
+    
+    for manifest in required_manifests:
+        if os.path.exists(manifest):
+            with open(manifest) as f:
+                count = sum(1 for _ in f)
+            print(f"✅ {manifest}: {count} images")
+            if count == 0:
+                all_good = False
         else:
-            print(f"❌ {dir_path}: Missing!")
+            print(f"❌ {manifest}: Missing!")
             all_good = False
     
     if os.path.exists('dataset.yaml'):
@@ -1,11 +1,19 @@
 import os
-import shutil
-import random
-import glob
+import functools
+import numpy as np
 from pathlib import Path
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataset_utils import materialize, count_files
+
+@functools.lru_cache(maxsize=None)
+def list_files(dirpath, ext=''):
+    """Names of the files in dirpath ending with ext, listed once per run"""
+    with os.scandir(dirpath) as it:
+        return tuple(e.name for e in it if e.name.endswith(ext) and e.is_file())
 
 def split_unified_dataset(image_dir='DeepPCB/all_images', labels_dir='DeepPCB/labels', 
-                         train_ratio=0.7, val_ratio=0.2, test_ratio=0.1):
+                         train_ratio=0.7, val_ratio=0.2, test_ratio=0.1, seed=42):
     """
     Split the unified dataset into train, validation, and test sets
     """
@@ -33,46 +41,54 @@ def split_unified_dataset(image_dir='DeepPCB/all_images', labels_dir='DeepPCB/la
         for dir_path in split_dirs.values():
             os.makedirs(dir_path, exist_ok=True)
     
-    # Get all label files (these determine which images we have)
-    label_files = glob.glob(os.path.join(labels_dir, '*.txt'))
+    # Get all label files (these determine which images we have); sorted so the
+    # seeded shuffle does not depend on the filesystem's listing order
+    label_files = [os.path.join(labels_dir, n) for n in sorted(list_files(labels_dir, '.txt'))]
     
     if not label_files:
         print("❌ No label files found! Make sure you've run the conversion script first.")
         return False
     
+    # Index the image directory once: by basename, and by each '_' token for fuzzy matches
+    image_exts = ['.jpg', '.jpeg', '.png', '.JPG', '.JPEG', '.PNG']
+    entries = sorted(list_files(image_dir))
+    
+    by_base = {}
+    by_token = defaultdict(list)
+    for name in entries:
+        base, ext = os.path.splitext(name)
+        path = os.path.join(image_dir, name)
+        
+        # Earlier extensions in image_exts win when a basename appears twice
+        if ext in image_exts:
+            current = by_base.get(base)
+            if current is None or image_exts.index(ext) < image_exts.index(os.path.splitext(current)[1]):
+                by_base[base] = path
+        
+        for part in base.split('_'):
+            if len(part) > 3:
+                by_token[part].append(path)
+    
     # Create pairs of (image_file, label_file) that actually exist
     valid_pairs = []
     
     for label_file in label_files:
         label_basename = os.path.splitext(os.path.basename(label_file))[0]
         
-        # Find corresponding image file
-        possible_image_names = []
+        # Try the known naming patterns (convert_deeppcb.py keeps the '_test' suffix)
+        found_image = (by_base.get(label_basename)
+                       or by_base.get(label_basename.replace('group', ''))
+                       or by_base.get(f"{label_basename}_test"))
         
-        # Try different image extensions and naming patterns
-        for ext in ['.jpg', '.jpeg', '.png', '.JPG', '.JPEG', '.PNG']:
-            possible_image_names.extend([
-                os.path.join(image_dir, label_basename + ext),
-                os.path.join(image_dir, label_basename.replace('group', '') + ext),
-            ])
-        
-        # Find which image file actually exists
-        found_image = None
-        for possible_image in possible_image_names:
-            if os.path.exists(possible_image):
-                found_image = possible_image
-                break
+        if not found_image:
+            # Try to find any image that might match
+            for part in label_basename.split('_'):
+                if len(part) > 3 and by_token.get(part):
+                    found_image = by_token[part][0]
+                    break
         
         if found_image:
             valid_pairs.append((found_image, label_file))
-        else:
-            # Try to find any image that might match
-            all_images = glob.glob(os.path.join(image_dir, '*'))
-            for img_path in all_images:
-                img_basename = os.path.splitext(os.path.basename(img_path))[0]
-                if any(part in img_basename for part in label_basename.split('_') if len(part) > 3):
-                    valid_pairs.append((img_path, label_file))
-                    break
     
     print(f"📊 Found {len(valid_pairs)} valid image-label pairs")
     
@@ -80,8 +96,9 @@ def split_unified_dataset(image_dir='DeepPCB/all_images', labels_dir='DeepPCB/la
         print("❌ No valid image-label pairs found!")
         return False
     
-    # Shuffle the pairs
-    random.shuffle(valid_pairs)
+    # Shuffle the pairs (seeded, so reruns give the same split)
+    idx = np.random.default_rng(seed).permutation(len(valid_pairs))
+    valid_pairs = [valid_pairs[i] for i in idx]
     
     # Calculate split indices
     total_pairs = len(valid_pairs)
@@ -95,20 +112,34 @@ def split_unified_dataset(image_dir='DeepPCB/all_images', labels_dir='DeepPCB/la
         'test': valid_pairs[val_end:]
     }
     
-    # Copy files to respective directories
+    # Collect every link for all splits, keyed by destination: the token
+    # fallback can map several labels to one image, and two threads must
+    # never materialize the same dst
+    tasks = {}
     for split_name, pairs in splits.items():
         print(f"📁 Processing {split_name} split: {len(pairs)} pairs")
         
         for image_path, label_path in pairs:
-            # Copy image
+            # Link image
             image_filename = os.path.basename(image_path)
             dst_image = os.path.join(output_dirs[split_name]['images'], image_filename)
-            shutil.copy2(image_path, dst_image)
+            tasks[dst_image] = image_path
             
-            # Copy label
+            # Link label
             label_filename = os.path.basename(label_path)
             dst_label = os.path.join(output_dirs[split_name]['labels'], label_filename)
-            shutil.copy2(label_path, dst_label)
+            tasks[dst_label] = label_path
+    
+    # Link/copy syscalls release the GIL, so overlap them to hide filesystem latency
+    with ThreadPoolExecutor(max_workers=min(32, 4 * (os.cpu_count() or 1))) as executor:
+        list(executor.map(materialize, tasks.values(), tasks.keys()))
+    
+    # Manifests from fix_and_setup_dataset.py would point training at an older split
+    for split_name in splits:
+        manifest = f'DeepPCB/{split_name}.txt'
+        if os.path.exists(manifest):
+            os.remove(manifest)
+            print(f"🗑️  Removed stale {manifest}")
     
     print("\n✅ Dataset split completed!")
     print(f"📊 Final split:")
@@ -135,15 +166,15 @@ def verify_dataset_structure():
     all_good = True
     
     for dir_path in required_dirs:
-        if os.path.exists(dir_path):
-            file_count = len(os.listdir(dir_path))
+        file_count = count_files(dir_path)
+        if file_count < 0:
+            print(f"  ❌ {dir_path}: Missing!")
+            all_good = False
+        else:
             print(f"  ✅ {dir_path}: {file_count} files")
             if file_count == 0:
                 print(f"     ⚠️  Warning: Directory is empty!")
                 all_good = False
-        else:
-            print(f"  ❌ {dir_path}: Missing!")
-            all_good = False
     
     if all_good:
         print("\n🎉 Dataset structure is ready for training!")
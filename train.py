@@ -3,7 +3,9 @@ import os
 import subprocess
 import sys
 import yaml
+import functools
 from pathlib import Path
+from dataset_utils import count_files
 
 def install_yolov5():
     """Install YOLOv5 repository if not present"""
@@ -29,13 +31,38 @@ def install_yolov5():
     
     return True
 
+@functools.lru_cache(maxsize=None)
+def uses_split_manifests():
+    """True when the splits are txt lists of image paths rather than directories"""
+    splits = ('train', 'val', 'test')
+    has_manifests = all(os.path.exists(f'DeepPCB/{split}.txt') for split in splits)
+    has_dirs = all(os.path.isdir(f'DeepPCB/images/{split}') for split in splits)
+    if not (has_manifests and has_dirs):
+        return has_manifests
+    
+    # Both layouts are on disk: trust the dataset.yaml the last preparation
+    # script wrote, since the other layout is a leftover from an older run
+    train_entry = ''
+    if os.path.exists('dataset.yaml'):
+        with open('dataset.yaml') as f:
+            train_entry = str((yaml.safe_load(f) or {}).get('train', ''))
+    use_manifests = train_entry.endswith('.txt')
+    
+    layout = "split manifests (DeepPCB/*.txt)" if use_manifests else "split directories (DeepPCB/images/*)"
+    print("⚠️  Found both split manifests and split directories")
+    print(f"   Using {layout}, as listed in dataset.yaml")
+    return use_manifests
+
 def create_dataset_yaml():
     """Create dataset configuration file for training"""
+    if uses_split_manifests():
+        splits = {'train': 'train.txt', 'val': 'val.txt', 'test': 'test.txt'}
+    else:
+        splits = {'train': 'images/train', 'val': 'images/val', 'test': 'images/test'}
+    
     dataset_config = {
         'path': str(Path.cwd() / 'DeepPCB'),  # Absolute path to dataset
-        'train': 'images/train',
-        'val': 'images/val',
-        'test': 'images/test',
+        **splits,
         'nc': 6,  # number of classes
         'names': {
             0: 'open',
@@ -55,6 +82,14 @@ def create_dataset_yaml():
 
 def check_dataset_structure():
     """Check if dataset is properly prepared"""
+    if uses_split_manifests():
+        print("📊 Dataset structure:")
+        for split in ('train', 'val', 'test'):
+            with open(f'DeepPCB/{split}.txt') as f:
+                image_count = sum(1 for _ in f)
+            print(f"   DeepPCB/{split}.txt: {image_count} images")
+        return True
+    
     required_dirs = [
         'DeepPCB/images/train',
         'DeepPCB/images/val', 
@@ -64,14 +99,9 @@ def check_dataset_structure():
         'DeepPCB/labels/test'
     ]
     
-    missing_dirs = []
-    empty_dirs = []
-    
-    for dir_path in required_dirs:
-        if not os.path.exists(dir_path):
-            missing_dirs.append(dir_path)
-        elif len(os.listdir(dir_path)) == 0:
-            empty_dirs.append(dir_path)
+    counts = {dir_path: count_files(dir_path) for dir_path in required_dirs}
+    missing_dirs = [dir_path for dir_path, count in counts.items() if count < 0]
+    empty_dirs = [dir_path for dir_path, count in counts.items() if count == 0]
     
     if missing_dirs:
         print("❌ Missing directories:")
@@ -86,10 +116,8 @@ def check_dataset_structure():
     
     # Count files in each directory
     print("📊 Dataset structure:")
-    for dir_path in required_dirs:
-        if os.path.exists(dir_path):
-            file_count = len(os.listdir(dir_path))
-            print(f"   {dir_path}: {file_count} files")
+    for dir_path, file_count in counts.items():
+        print(f"   {dir_path}: {file_count} files")
     
     return True
 